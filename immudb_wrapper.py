@@ -1,18 +1,34 @@
 import hashlib
+import io
 import json
 import logging
+import math
 import os
-import re
-from dataclasses import asdict
-from functools import wraps
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from dataclasses import asdict, fields
+from functools import lru_cache, partial, wraps
 from pathlib import Path
 from time import sleep
 from traceback import format_exc
-from typing import IO, Any, Dict, List, Optional, Union
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.parse import urlparse
 
 from git import Repo
-from grpc import RpcError
+from grpc import RpcError, StatusCode
 from grpc._channel import _InactiveRpcError
 from immudb import ImmudbClient
 from immudb.datatypes import SafeGetResponse
@@ -20,6 +36,259 @@ from immudb.rootService import RootService
 
 Dict = Dict[str, Any]
 
+_SGR_FIELDS = tuple(field.name for field in fields(SafeGetResponse))
+
+
+@lru_cache(maxsize=None)
+def _get_hash_constructor(checksum_type: str):
+    # Named constructors (e.g. hashlib.sha256) are bound directly
+    # to OpenSSL, which already selects SHA-NI/ARMv8 SHA2 code paths
+    # at runtime, so there is no need for the generic hashlib.new lookup
+    constructor = getattr(hashlib, checksum_type.lower(), None)
+    if checksum_type.lower() in hashlib.algorithms_guaranteed and callable(
+        constructor,
+    ):
+        return constructor
+    return partial(hashlib.new, checksum_type)
+
+
+GIT_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+
+def _extract_git_metadata(repo, head_sha: str) -> Dict:
+    commit = repo.commit(head_sha)
+    return {
+        'Author': {
+            'Email': commit.author.email,
+            'Name': commit.author.name,
+            'When': commit.authored_datetime.strftime(
+                GIT_DATETIME_FORMAT,
+            ),
+        },
+        'Commit': commit.hexsha,
+        'Committer': {
+            'Email': commit.committer.email,
+            'Name': commit.committer.name,
+            'When': commit.committed_datetime.strftime(
+                GIT_DATETIME_FORMAT,
+            ),
+        },
+        'Message': commit.message,
+        'PGPSignature': commit.gpgsig,
+        'Parents': [parent.hexsha for parent in commit.iter_parents()],
+        'Tree': commit.tree.hexsha,
+    }
+
+
+# An entry holds the hashes of all ancestor commits, which may take
+# several MB for large repositories, so only a few recent ones are kept
+@lru_cache(maxsize=32)
+def _git_metadata_cached(
+    repo_path: str,
+    head_sha: str,
+    remote_url: str,
+) -> Tuple[Dict, str]:
+    """
+    Extracts the git metadata of the commit `head_sha` and returns it
+    together with SHA256 hash of its JSON representation.
+    Results are cached, so repeated calls for the same repository
+    state don't walk the git object database again.
+    """
+    with Repo(repo_path) as repo:
+        git_metadata = _extract_git_metadata(repo, head_sha)
+    url = urlparse(remote_url)
+    url_path = url.path
+    if url_path.startswith('/'):
+        url_path = f':{url_path[1:]}'
+    name = f'git@{url.netloc}{url_path}@{head_sha[:7]}'
+    metadata = {
+        'Name': name,
+        'git': git_metadata,
+    }
+    # the hash must be calculated from the stdlib JSON representation,
+    # otherwise it won't match the hashes of already notarized repos
+    metadata_hash = _get_hash_constructor('sha256')(
+        json.dumps(metadata['git']).encode(),
+    ).hexdigest()
+    return metadata, metadata_hash
+
+
+def _get_git_metadata(
+    repo_path: Union[str, os.PathLike],
+) -> Tuple[Dict, str]:
+    repo_path = os.path.abspath(repo_path)
+    with Repo(repo_path) as repo:
+        head_sha = repo.rev_parse('HEAD').hexsha
+        remote_url = repo.remote().url
+    return _git_metadata_cached(repo_path, head_sha, remote_url)
+
+
+SIZE_UNITS = ('', 'K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
+
+# The buffer size doesn't change the checksum, so it isn't
+# the part of the file hash cache key
+CACHED_HASHING_BUFF_SIZE = 1048576
+
+
+def _hash_file(
+    file_path: Union[str, IO],
+    hasher,
+    buff_size: int,
+) -> str:
+    """
+    Feeds the hasher with the file content and returns
+    the hexadecimal digest.
+    """
+
+    def feed_hasher(_fd):
+        buff = _fd.read(buff_size)
+        while len(buff):
+            if not isinstance(buff, bytes):
+                buff = buff.encode()
+            hasher.update(buff)
+            buff = _fd.read(buff_size)
+
+    def can_digest_file(_fd) -> bool:
+        # hashlib.file_digest (Python 3.11+) runs the whole read/update
+        # loop in C, but accepts only binary file objects
+        return sys.version_info >= (3, 11) and isinstance(
+            _fd,
+            (io.BufferedIOBase, io.RawIOBase),
+        )
+
+    if isinstance(file_path, str):
+        # file_digest does its own buffering
+        with open(file_path, 'rb', buffering=0) as fd:
+            # let the kernel read ahead while hashing; fadvise fails
+            # with ESPIPE on pipes and FIFOs
+            if hasattr(os, 'posix_fadvise') and stat.S_ISREG(
+                os.fstat(fd.fileno()).st_mode,
+            ):
+                os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            if can_digest_file(fd):
+                return hashlib.file_digest(fd, lambda: hasher).hexdigest()
+            feed_hasher(fd)
+    else:
+        file_path.seek(0)
+        if can_digest_file(file_path):
+            return hashlib.file_digest(
+                file_path,
+                lambda: hasher,
+            ).hexdigest()
+        feed_hasher(file_path)
+    return hasher.hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _hash_file_cached(
+    file_path: str,
+    file_id: Tuple[int, int, int, int, int],
+    hash_type: str,
+) -> str:
+    """
+    Returns checksum of the file. The device, inode, size, modification
+    and change times of the file are the part of the cache key,
+    so unchanged files aren't read and hashed again. The change time
+    can't be set by a user, so the changed file gets a new key even if
+    its modification time was restored.
+    """
+    return _hash_file(
+        file_path,
+        _get_hash_constructor(hash_type)(),
+        CACHED_HASHING_BUFF_SIZE,
+    )
+
+
+def _map_concurrently(
+    func,
+    items: Iterable,
+    max_workers: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Calls the function for every item in a thread pool and returns
+    the results in the same order as the items. An item the function
+    raised an exception for gets a dict with an error instead.
+    """
+
+    def call(item) -> Dict:
+        try:
+            return func(item)
+        except Exception:
+            return {'error': format_exc()}
+
+    # the threads mostly wait for the disk and the gRPC responses,
+    # so the parallelism comes from the overlapping I/O
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(call, items))
+
+
+class _SharedLock:
+    """
+    Lock that can be held by many threads at once in the shared mode,
+    or by a single thread in the exclusive mode.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._holders = 0
+        self._exclusive = False
+        self._exclusive_waiters = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            # new holders wait, so the exclusive mode isn't starved
+            self._condition.wait_for(
+                lambda: not self._exclusive and not self._exclusive_waiters,
+            )
+            self._holders += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._holders -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._exclusive_waiters += 1
+            self._condition.wait_for(
+                lambda: not self._exclusive and not self._holders,
+            )
+            self._exclusive_waiters -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class _SynchronizedRootService(RootService):
+    """
+    Thread-safe wrapper around RootService, concurrent requests
+    can't move the verified state back to an older transaction.
+    """
+
+    def __init__(self, root_service: RootService):
+        self._root_service = root_service
+        self._lock = threading.Lock()
+
+    def init(self, dbname: str, service):
+        with self._lock:
+            self._root_service.init(dbname, service)
+
+    def get(self):
+        with self._lock:
+            return self._root_service.get()
+
+    def set(self, root):
+        with self._lock:
+            if root.txId >= self._root_service.get().txId:
+                self._root_service.set(root)
+
 
 class ImmudbWrapper(ImmudbClient):
     def __init__(
@@ -69,6 +338,11 @@ class ImmudbWrapper(ImmudbClient):
         self.logger = logger
         if not logger:
             self.logger = logging.getLogger()
+        # requests hold the session lock in the shared mode,
+        # so logging in never swaps the stub under running requests
+        self._session_lock = _SharedLock()
+        self._login_lock = threading.Lock()
+        self._login_generation = 0
         super().__init__(
             immudUrl=immudb_address,
             rs=root_service,
@@ -76,6 +350,7 @@ class ImmudbWrapper(ImmudbClient):
             timeout=timeout,
             max_grpc_message_length=max_grpc_message_length,
         )
+        self._rs = _SynchronizedRootService(self._rs)
         self.login()
 
     def retry(possible_exc_details: Optional[List[str]] = None):
@@ -87,12 +362,21 @@ class ImmudbWrapper(ImmudbClient):
             def wrapped(self, *args, **kwargs):
                 max_retries = self.max_retries
                 last_exc = Exception()
+                logged_in_again = False
                 while max_retries:
+                    login_generation = self._login_generation
                     try:
                         return func(self, *args, **kwargs)
                     except _InactiveRpcError as exc:
                         exc_details = exc.details()
                         last_exc = exc
+                        if (
+                            exc.code() == StatusCode.UNAUTHENTICATED
+                            and not logged_in_again
+                        ):
+                            logged_in_again = True
+                            self._login_again(login_generation, func.__name__)
+                            continue
                         if exc_details and any(
                             detail in exc_details
                             for detail in possible_exc_details
@@ -115,12 +399,35 @@ class ImmudbWrapper(ImmudbClient):
 
     def login(self):
         encoded_database = self.encode(self.database)
-        super().login(
-            username=self.username,
-            password=self.password,
-            database=encoded_database,
-        )
-        self.useDatabase(encoded_database)
+        with self._session_lock.exclusive():
+            super().login(
+                username=self.username,
+                password=self.password,
+                database=encoded_database,
+            )
+            self.useDatabase(encoded_database)
+            self._login_generation += 1
+
+    def _login_again(self, login_generation: int, func_name: str):
+        with self._login_lock:
+            # another thread has already logged in again
+            if login_generation != self._login_generation:
+                return
+            self.logger.warning(
+                'Logging in again before running the "%s" function',
+                func_name,
+            )
+            self.login()
+
+    @retry(possible_exc_details=['Connection timed out'])
+    def verifiedGet(self, *args, **kwargs):
+        with self._session_lock.shared():
+            return super().verifiedGet(*args, **kwargs)
+
+    @retry(possible_exc_details=['Connection timed out'])
+    def verifiedSet(self, *args, **kwargs):
+        with self._session_lock.shared():
+            return super().verifiedSet(*args, **kwargs)
 
     @classmethod
     def get_version(cls) -> str:
@@ -146,10 +453,10 @@ class ImmudbWrapper(ImmudbClient):
         self,
         value: Union[str, bytes, dict],
     ) -> bytes:
-        if isinstance(value, str):
-            result = value.encode()
-        elif isinstance(value, bytes):
+        if isinstance(value, bytes):
             result = value
+        elif isinstance(value, str):
+            result = value.encode()
         elif isinstance(value, dict):
             result = json.dumps(value).encode()
         else:
@@ -162,9 +469,11 @@ class ImmudbWrapper(ImmudbClient):
         self,
         response: SafeGetResponse,
     ) -> Dict:
-        result = asdict(response)
+        # the response contains only plain values,
+        # so there is no need in the recursive copying of asdict
+        result = {name: getattr(response, name) for name in _SGR_FIELDS}
         result['key'] = result['key'].decode()
-        result['value'] = json.loads(result['value'].decode())
+        result['value'] = json.loads(result['value'])
         return result
 
     def get_size_format(
@@ -179,23 +488,42 @@ class ImmudbWrapper(ImmudbClient):
             1253656 => '1.20 MB'
             1253656678 => '1.17 GB'
         """
-        for unit in [
-            '',
-            'K',
-            'M',
-            'G',
-            'T',
-            'P',
-            'E',
-            'Z',
-        ]:
-            if value < factor:
-                return f'{value:.2f} {unit}{suffix}'
-            value /= factor
-        return f'{value:.2f} Y{suffix}'
+        if factor != 1024:
+            # a single division by factor**index rounds differently
+            for unit in SIZE_UNITS[:-1]:
+                if value < factor:
+                    return f'{value:.2f} {unit}{suffix}'
+                value /= factor
+            return f'{value:.2f} {SIZE_UNITS[-1]}{suffix}'
+        if value < factor:
+            return f'{value:.2f} {suffix}'
+        index = min(int(math.log(value, factor)), len(SIZE_UNITS) - 1)
+        # math.log may be off by one, the scaled value decides as in the loop
+        if index < len(SIZE_UNITS) - 1 and value / factor**index >= factor:
+            index += 1
+        elif value / factor**index < 1:
+            index -= 1
+        return f'{value / factor**index:.2f} {SIZE_UNITS[index]}{suffix}'
 
     def get_directory_size(self, path: Union[str, os.PathLike]) -> int:
-        return sum(file.stat().st_size for file in Path(path).rglob('*') if file.exists())
+        total_size = 0
+        directories = [path]
+        while directories:
+            try:
+                entries = os.scandir(directories.pop())
+            except OSError:
+                # e.g. missing path, not a directory or permission denied
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        total_size += entry.stat().st_size
+                    except OSError:
+                        # e.g. broken symlink or symlink loop
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+        return total_size
 
     def get_file_size(self, file_path: Union[str, os.PathLike]) -> int:
         return Path(file_path).stat().st_size
@@ -215,7 +543,7 @@ class ImmudbWrapper(ImmudbClient):
         hashlib._Hash
             Hashlib hashing function.
         """
-        return hashlib.new(checksum_type)
+        return _get_hash_constructor(checksum_type)()
 
     def hash_file(
         self,
@@ -223,6 +551,7 @@ class ImmudbWrapper(ImmudbClient):
         hash_type: str = 'sha256',
         buff_size: int = 1048576,
         hasher=None,
+        use_cache: bool = False,
     ) -> str:
         """
         Returns checksum (hexadecimal digest) of the file.
@@ -234,33 +563,40 @@ class ImmudbWrapper(ImmudbClient):
         hash_type : str
             Hash type (e.g. sha1, sha256).
         buff_size : int
-            Number of bytes to read at once.
+            Number of bytes to read at once. Ignored for binary files
+            on Python 3.11+, which are hashed by `hashlib.file_digest`.
         hasher : hashlib._Hash
             Any hash algorithm from hashlib.
+        use_cache : bool
+            Reuse the checksum calculated earlier if the file
+            (by path) is unchanged since then. Shouldn't be used
+            for the file authentication.
 
         Returns
         -------
         str
             Checksum (hexadecimal digest) of the file.
         """
-        if hasher is None:
-            hasher = self.get_hasher(hash_type)
-
-        def feed_hasher(_fd):
-            buff = _fd.read(buff_size)
-            while len(buff):
-                if not isinstance(buff, bytes):
-                    buff = buff.encode()
-                hasher.update(buff)
-                buff = _fd.read(buff_size)
-
-        if isinstance(file_path, str):
-            with open(file_path, 'rb') as fd:
-                feed_hasher(fd)
-        else:
-            file_path.seek(0)
-            feed_hasher(file_path)
-        return hasher.hexdigest()
+        if not use_cache or hasher is not None or not isinstance(
+            file_path,
+            str,
+        ):
+            if hasher is None:
+                hasher = self.get_hasher(hash_type)
+            return _hash_file(file_path, hasher, buff_size)
+        file_stat = os.stat(file_path)
+        return _hash_file_cached(
+            os.path.realpath(file_path),
+            (
+                file_stat.st_dev,
+                file_stat.st_ino,
+                file_stat.st_size,
+                file_stat.st_mtime_ns,
+                file_stat.st_ctime_ns,
+            ),
+            # "SHA256" and "sha256" give the same checksum
+            hash_type.lower(),
+        )
 
     def hash_content(
         self,
@@ -276,40 +612,7 @@ class ImmudbWrapper(ImmudbClient):
     def extract_git_metadata(
         repo_path: Union[str, os.PathLike],
     ) -> Dict:
-        with Repo(repo_path) as repo:
-            url = urlparse(repo.remote().url)
-            commit = repo.commit()
-            name = (
-                f'git@{url.netloc}'
-                f'{re.sub(r"^/", ":", url.path)}'
-                f'@{commit.hexsha[:7]}'
-            )
-            return {
-                'Name': name,
-                'git': {
-                    'Author': {
-                        'Email': commit.author.email,
-                        'Name': commit.author.name,
-                        'When': commit.authored_datetime.strftime(
-                            '%Y-%m-%dT%H:%M:%S%z',
-                        ),
-                    },
-                    'Commit': commit.hexsha,
-                    'Committer': {
-                        'Email': commit.committer.email,
-                        'Name': commit.committer.name,
-                        'When': commit.committed_datetime.strftime(
-                            '%Y-%m-%dT%H:%M:%S%z',
-                        ),
-                    },
-                    'Message': commit.message,
-                    'PGPSignature': commit.gpgsig,
-                    'Parents': [
-                        parent.hexsha for parent in commit.iter_parents()
-                    ],
-                    'Tree': commit.tree.hexsha,
-                },
-            }
+        return deepcopy(_get_git_metadata(repo_path)[0])
 
     @property
     def default_metadata(self) -> Dict:
@@ -347,18 +650,33 @@ class ImmudbWrapper(ImmudbClient):
         except RpcError:
             return {'error': format_exc()}
 
-    @retry(possible_exc_details=['Connection timed out'])
     def notarize(
         self,
         key: str,
         value: Union[str, bytes, Dict],
     ) -> Dict:
-        self.login()
         result = self.verified_set(key, value)
         if 'error' in result:
             return result
         return self.verified_get(key)
 
+    def notarize_many(
+        self,
+        items: Iterable[Tuple[str, Union[str, bytes, Dict]]],
+        max_workers: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        This method notarizes the provided (key, value) pairs concurrently
+        over the shared gRPC channel.
+        Returns the results in the same order as the provided items,
+        a result is a dict with an error if the item wasn't notarized.
+        """
+        return _map_concurrently(
+            lambda item: self.notarize(*item),
+            items,
+            max_workers,
+        )
+
     def notarize_file(
         self,
         file: str,
@@ -368,24 +686,51 @@ class ImmudbWrapper(ImmudbClient):
         This method calculates the file hash and file size and inserts them
         with the user's metadata (if provided), into the database.
         """
+        hash_file = self.hash_file(file)
+        return self.notarize(
+            key=hash_file,
+            value=self._get_file_payload(file, hash_file, user_metadata),
+        )
+
+    def notarize_files(
+        self,
+        files: List[str],
+        user_metadata: Optional[Dict] = None,
+        max_workers: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        This method calculates hashes and sizes of the provided files
+        and inserts them with the user's metadata (if provided),
+        into the database. Files are hashed and notarized concurrently.
+        Returns the results in the same order as the provided files,
+        a result is a dict with an error if the file wasn't notarized
+        (e.g. it couldn't be read), the other files are notarized anyway.
+        """
+        return _map_concurrently(
+            lambda file: self.notarize_file(file, user_metadata),
+            files,
+            max_workers,
+        )
+
+    def _get_file_payload(
+        self,
+        file: str,
+        file_hash: str,
+        user_metadata: Optional[Dict] = None,
+    ) -> Dict:
         if not user_metadata:
             user_metadata = {}
-        hash_file = self.hash_file(file)
-        payload = {
+        return {
             'Name': Path(file).name,
             'Kind': 'file',
             'Size': self.get_size_format(self.get_file_size(file)),
-            'Hash': hash_file,
+            'Hash': file_hash,
             'Signer': self.username,
             'Metadata': {
                 **self.default_metadata,
                 **user_metadata,
             },
         }
-        return self.notarize(
-            key=hash_file,
-            value=payload,
-        )
 
     def notarize_git_repo(
         self,
@@ -401,8 +746,8 @@ class ImmudbWrapper(ImmudbClient):
         """
         if not user_metadata:
             user_metadata = {}
-        git_metadata = self.extract_git_metadata(repo_path)
-        metadata_hash = self.hash_content(json.dumps(git_metadata['git']))
+        # the cached metadata is only serialized, so it isn't copied
+        git_metadata, metadata_hash = _get_git_metadata(repo_path)
         payload = {
             'Name': git_metadata['Name'],
             'Kind': 'git',
@@ -420,21 +765,27 @@ class ImmudbWrapper(ImmudbClient):
             value=payload,
         )
 
-    @retry(possible_exc_details=['Connection timed out'])
     def authenticate(
         self,
         key: Union[str, bytes],
     ) -> Dict:
-        self.login()
         return self.verified_get(key)
 
-    def authenticate_file(self, file: str) -> Dict:
+    def authenticate_file(
+        self,
+        file: str,
+        precomputed_hash: Optional[str] = None,
+    ) -> Dict:
         """
         This method calculates the file hash of the provided file
         and looks up the metadata of that hash in the database.
+        The calculation is skipped if the hash is provided
+        (e.g. the "key" of the `notarize_file` result).
         Returns a dict with an error if metadata doesn't exist in the database.
         """
-        return self.authenticate(self.hash_file(file))
+        if precomputed_hash is None:
+            precomputed_hash = self.hash_file(file)
+        return self.authenticate(precomputed_hash)
 
     def authenticate_git_repo(
         self,
@@ -446,9 +797,5 @@ class ImmudbWrapper(ImmudbClient):
         the metadata of that hash in the database.
         Returns a dict with an error if metadata doesn't exist in the database.
         """
-        metadata_hash = self.hash_content(
-            json.dumps(
-                self.extract_git_metadata(repo_path)['git'],
-            ),
-        )
+        _, metadata_hash = _get_git_metadata(repo_path)
         return self.authenticate(metadata_hash)
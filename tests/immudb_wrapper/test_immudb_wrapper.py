@@ -1,6 +1,555 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from enum import Enum, IntEnum
+from unittest import mock
+
+import pytest
+from git import Actor, InvalidGitRepositoryError, Repo
+from grpc import StatusCode
+from grpc._channel import _InactiveRpcError
+from immudb import ImmudbClient
+from immudb.datatypes import SafeGetResponse, SetResponse
+from immudb.rootService import RootService
+
+import immudb_wrapper
 from immudb_wrapper import ImmudbWrapper
 
 
+@pytest.fixture
+def client():
+    with mock.patch.object(ImmudbWrapper, 'login'):
+        yield ImmudbWrapper()
+
+
 class TestImmudbWrapper:
     def test_example(self):
         pass
+
+    @pytest.mark.parametrize(
+        'file_obj',
+        [
+            io.BytesIO(b'foo bar'),
+            io.StringIO('foo bar'),
+            tempfile.SpooledTemporaryFile(mode='w+b'),
+            tempfile.SpooledTemporaryFile(mode='w+'),
+        ],
+    )
+    def test_hash_file_object(self, client, file_obj):
+        if isinstance(file_obj, tempfile.SpooledTemporaryFile):
+            file_obj.write(b'foo bar' if 'b' in file_obj.mode else 'foo bar')
+        assert client.hash_file(file_obj) == (
+            hashlib.sha256(b'foo bar').hexdigest()
+        )
+
+    def test_hash_file_path(self, client, tmp_path):
+        content = os.urandom(3 * 1048576 + 123)
+        file_path = tmp_path / 'foo'
+        file_path.write_bytes(content)
+        assert client.hash_file(str(file_path), buff_size=65536) == (
+            hashlib.sha256(content).hexdigest()
+        )
+
+    def test_hash_fifo(self, client, tmp_path):
+        fifo_path = str(tmp_path / 'fifo')
+        os.mkfifo(fifo_path)
+
+        def write_fifo():
+            with open(fifo_path, 'wb') as fd:
+                fd.write(b'foo bar')
+
+        writer = threading.Thread(target=write_fifo)
+        writer.start()
+        try:
+            assert client.hash_file(fifo_path) == (
+                hashlib.sha256(b'foo bar').hexdigest()
+            )
+        finally:
+            writer.join()
+
+
+def create_git_repo(
+    repo_path,
+    remote_url='https://git.almalinux.org/foo/bar.git',
+):
+    actor = Actor('Foo Bar', 'foo@bar.com')
+    repo = Repo.init(repo_path)
+    if remote_url:
+        repo.create_remote('origin', remote_url)
+
+    def commit(message, parents, date='1690023202 +0200', author=actor):
+        return repo.index.commit(
+            message,
+            parent_commits=parents,
+            author=author,
+            committer=author,
+            author_date=date,
+            commit_date=date,
+        )
+
+    root = commit('Initial commit\n', [])
+    # commits with the same date check the order of the parents
+    first = commit('First\n', [root])
+    second = commit('Second\n', [root])
+    merge = commit('Merge\n', [first, second])
+    leading_newlines = commit('\n\nLeading newlines\n', [merge])
+    with repo.config_writer() as config:
+        config.set_value('i18n', 'commitEncoding', 'ISO-8859-1')
+    latin1 = commit(
+        'Nicht UTF-8: äöü\n',
+        [leading_newlines],
+        author=Actor('Jörg Müller', 'joerg@bar.com'),
+    )
+    with repo.config_writer() as config:
+        config.remove_section('i18n')
+    commit('Last\n', [latin1], '1690108200 -0130')
+    repo.close()
+    return repo_path
+
+
+@pytest.fixture
+def git_metadata_cache():
+    immudb_wrapper._git_metadata_cached.cache_clear()
+    yield
+    immudb_wrapper._git_metadata_cached.cache_clear()
+
+
+class TestGitMetadata:
+    def test_metadata(self, client, tmp_path, git_metadata_cache):
+        metadata = client.extract_git_metadata(create_git_repo(str(tmp_path)))
+        assert len(metadata['git']['Parents']) == 6
+        assert metadata['git']['PGPSignature'] == ''
+        assert metadata['git']['Committer']['When'] == (
+            '2023-07-23T09:00:00-0130'
+        )
+
+    def test_hash_matches_metadata(self, client, tmp_path, git_metadata_cache):
+        repo_path = create_git_repo(str(tmp_path))
+        metadata, metadata_hash = immudb_wrapper._get_git_metadata(
+            repo_path,
+        )
+        assert metadata['Name'].startswith(
+            'git@git.almalinux.org:foo/bar.git@',
+        )
+        assert metadata_hash == client.hash_content(
+            json.dumps(client.extract_git_metadata(repo_path)['git']),
+        )
+
+    def test_notarize_git_repo(self, client, tmp_path, git_metadata_cache):
+        repo_path = create_git_repo(str(tmp_path))
+        metadata, metadata_hash = immudb_wrapper._get_git_metadata(
+            repo_path,
+        )
+        with mock.patch.object(client, 'notarize') as notarize:
+            client.notarize_git_repo(repo_path, user_metadata={'foo': 'bar'})
+        payload = notarize.call_args.kwargs['value']
+        assert notarize.call_args.kwargs['key'] == metadata_hash
+        assert payload['Hash'] == metadata_hash
+        assert payload['Metadata']['git'] == metadata['git']
+        assert payload['Metadata']['foo'] == 'bar'
+
+    def test_recreated_repo(self, client, tmp_path, git_metadata_cache):
+        repo_path = create_git_repo(str(tmp_path / 'repo'))
+        client.extract_git_metadata(repo_path)
+        shutil.rmtree(repo_path)
+        create_git_repo(repo_path)
+        with Repo(repo_path) as repo:
+            head_sha = repo.index.commit('Another commit\n').hexsha
+        metadata = client.extract_git_metadata(repo_path)
+        assert metadata['git']['Commit'] == head_sha
+
+    def test_missing_origin(self, client, tmp_path, git_metadata_cache):
+        repo_path = create_git_repo(str(tmp_path), remote_url=None)
+        with pytest.raises(ValueError):
+            client.extract_git_metadata(repo_path)
+
+    def test_not_a_repo(self, client, tmp_path, git_metadata_cache):
+        with pytest.raises(InvalidGitRepositoryError):
+            client.extract_git_metadata(str(tmp_path))
+        # GitPython doesn't look for the repository in the parent directories
+        repo_path = create_git_repo(str(tmp_path / 'repo'))
+        os.mkdir(os.path.join(repo_path, 'subdir'))
+        with pytest.raises(InvalidGitRepositoryError):
+            client.extract_git_metadata(os.path.join(repo_path, 'subdir'))
+
+    def test_remote_url_is_not_rewritten(
+        self,
+        client,
+        tmp_path,
+        git_metadata_cache,
+    ):
+        repo_path = create_git_repo(str(tmp_path))
+        with Repo(repo_path) as repo, repo.config_writer() as config:
+            config.set_value(
+                'url "https://mirror.almalinux.org/"',
+                'insteadOf',
+                'https://git.almalinux.org/',
+            )
+        metadata = client.extract_git_metadata(repo_path)
+        assert metadata['Name'].startswith(
+            'git@git.almalinux.org:foo/bar.git@',
+        )
+
+
+class TestDirectorySize:
+    def test_directory_size(self, client, tmp_path):
+        (tmp_path / 'foo').write_bytes(b'foo')
+        (tmp_path / 'bar').mkdir()
+        (tmp_path / 'bar' / 'baz').write_bytes(b'bazbaz')
+        (tmp_path / 'broken').symlink_to(tmp_path / 'missing')
+        (tmp_path / 'loop').symlink_to(tmp_path / 'loop')
+        (tmp_path / 'link').symlink_to(tmp_path / 'bar')
+        expected_size = sum(
+            path.stat().st_size
+            for path in tmp_path.rglob('*')
+            if path.exists()
+        )
+        assert client.get_directory_size(tmp_path) == expected_size
+
+    def test_not_a_directory(self, client, tmp_path):
+        (tmp_path / 'foo').write_bytes(b'foo')
+        assert client.get_directory_size(tmp_path / 'foo') == 0
+        assert client.get_directory_size(tmp_path / 'missing') == 0
+
+
+def format_size_by_division(value, factor=1024, suffix='B'):
+    # get_size_format before the unit index was computed with math.log
+    for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
+        if value < factor:
+            return f'{value:.2f} {unit}{suffix}'
+        value /= factor
+    return f'{value:.2f} Y{suffix}'
+
+
+class TestSizeFormat:
+    @pytest.mark.parametrize('factor', [1024, 1000])
+    @pytest.mark.parametrize(
+        'value',
+        [0, 1, 1023, 1024, 1025, 999, 1000, 1001, 1253656, 2**70, 2**100]
+        + [
+            base**power + delta
+            for base in (1024, 1000)
+            for power in range(2, 10)
+            for delta in (-1, 0, 1)
+        ]
+        # a single division by 1000**5 rounds them to "1000.00 PB"
+        + [10**18 - 62, 10**18 - 56],
+    )
+    def test_matches_repeated_division(self, client, value, factor):
+        assert client.get_size_format(value, factor) == (
+            format_size_by_division(value, factor)
+        )
+
+    @pytest.mark.parametrize(
+        'value, expected_size',
+        [
+            (0, '0.00 B'),
+            (1023, '1023.00 B'),
+            (1024, '1.00 KB'),
+            (1253656, '1.20 MB'),
+            (1253656678, '1.17 GB'),
+            # the next unit is used once the scaled float reaches 1024
+            (1024**2 - 1, '1024.00 KB'),
+            (1024**6 - 1, '1.00 EB'),
+            (1024**8, '1.00 YB'),
+            (1024**9, '1024.00 YB'),
+        ],
+    )
+    def test_size_format(self, client, value, expected_size):
+        assert client.get_size_format(value) == expected_size
+
+
+class FakeRpcError(_InactiveRpcError):
+    def __init__(self, code, details=''):
+        self._code = code
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+
+class TestConcurrency:
+    def test_root_service_keeps_newest_state(self):
+        base_root_service = RootService()
+        base_root_service.set(mock.Mock(txId=2))
+        root_service = immudb_wrapper._SynchronizedRootService(
+            base_root_service,
+        )
+        root_service.set(mock.Mock(txId=1))
+        assert root_service.get().txId == 2
+        root_service.set(mock.Mock(txId=3))
+        assert root_service.get().txId == 3
+
+    def test_concurrent_login_again(self):
+        threads_number = 8
+        barrier = threading.Barrier(threads_number)
+        with mock.patch.object(ImmudbClient, 'login'), mock.patch.object(
+            ImmudbClient,
+            'useDatabase',
+        ) as use_database:
+            client = ImmudbWrapper()
+
+            def verified_get(*args, **kwargs):
+                if use_database.call_count == 1:
+                    barrier.wait(timeout=5)
+                    raise FakeRpcError(StatusCode.UNAUTHENTICATED)
+                return 'ok'
+
+            with mock.patch.object(
+                ImmudbClient,
+                'verifiedGet',
+                side_effect=verified_get,
+            ), ThreadPoolExecutor(threads_number) as executor:
+                results = list(
+                    executor.map(
+                        lambda key: client.verifiedGet(key=key),
+                        range(threads_number),
+                    ),
+                )
+        assert results == ['ok'] * threads_number
+        # once in __init__ and once after the session has expired
+        assert use_database.call_count == 2
+
+    def test_timed_out_call_is_retried(self, client):
+        with mock.patch.object(
+            ImmudbClient,
+            'verifiedSet',
+            side_effect=[
+                FakeRpcError(StatusCode.UNAVAILABLE, 'Connection timed out'),
+                SetResponse(id=1, verified=True),
+            ],
+        ) as verified_set, mock.patch.object(
+            client,
+            'verified_get',
+            return_value={'id': 1},
+        ), mock.patch.object(immudb_wrapper, 'sleep') as sleep:
+            assert client.notarize('foo', 'bar') == {'id': 1}
+        assert verified_set.call_count == 2
+        sleep.assert_called_once_with(client.retry_timeout)
+
+    def test_notarize_many_errors(self, client):
+        with mock.patch.object(
+            ImmudbClient,
+            'verifiedSet',
+            return_value=SetResponse(id=1, verified=True),
+        ), mock.patch.object(client, 'verified_get', return_value={'id': 1}):
+            results = client.notarize_many(
+                [('foo', 'bar'), ('bar', 1), ('baz', {'foo': 'bar'})],
+            )
+        assert results[0] == {'id': 1}
+        assert 'ValueError' in results[1]['error']
+        assert results[2] == {'id': 1}
+
+    @staticmethod
+    def create_files(tmp_path, files_number):
+        file_paths = []
+        for number in range(files_number):
+            file_path = tmp_path / f'file_{number}'
+            # the first files are the largest and finish hashing last
+            file_path.write_bytes(b'foo' * (files_number - number) * 65536)
+            file_paths.append(str(file_path))
+        return file_paths
+
+    def test_notarize_files(self, client, tmp_path):
+        file_paths = self.create_files(tmp_path, 16)
+        file_paths.insert(2, str(tmp_path / 'missing'))
+        with mock.patch.object(
+            client,
+            'notarize',
+            side_effect=lambda key, value: {'key': key, 'value': value},
+        ):
+            results = client.notarize_files(
+                file_paths,
+                user_metadata={'foo': 'bar'},
+                max_workers=4,
+            )
+        assert 'FileNotFoundError' in results.pop(2)['error']
+        del file_paths[2]
+        assert [result['key'] for result in results] == [
+            client.hash_file(file_path) for file_path in file_paths
+        ]
+        assert [result['value']['Name'] for result in results] == [
+            os.path.basename(file_path) for file_path in file_paths
+        ]
+        assert all(
+            result['value']['Hash'] == result['key']
+            and result['value']['Metadata']['foo'] == 'bar'
+            for result in results
+        )
+
+
+class TestHashFileCache:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        immudb_wrapper._hash_file_cached.cache_clear()
+        yield
+        immudb_wrapper._hash_file_cached.cache_clear()
+
+    @staticmethod
+    def sha256(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def test_cache_is_disabled_by_default(self, client, tmp_path):
+        file_path = tmp_path / 'foo'
+        file_path.write_bytes(b'foo')
+        client.hash_file(str(file_path))
+        assert immudb_wrapper._hash_file_cached.cache_info().currsize == 0
+
+    def test_cached_hash(self, client, tmp_path):
+        file_path = str(tmp_path / 'foo')
+        with open(file_path, 'wb') as fd:
+            fd.write(b'foo')
+        for _ in range(2):
+            assert client.hash_file(file_path, use_cache=True) == (
+                self.sha256(b'foo')
+            )
+        assert immudb_wrapper._hash_file_cached.cache_info().hits == 1
+
+    def test_cache_key(self, client, tmp_path):
+        file_path = str(tmp_path / 'foo')
+        with open(file_path, 'wb') as fd:
+            fd.write(b'foo')
+        client.hash_file(file_path, hash_type='sha256', use_cache=True)
+        assert client.hash_file(
+            file_path,
+            hash_type='SHA256',
+            buff_size=3,
+            use_cache=True,
+        ) == self.sha256(b'foo')
+        assert immudb_wrapper._hash_file_cached.cache_info().hits == 1
+
+    def test_overwritten_with_restored_mtime(self, client, tmp_path):
+        file_path = str(tmp_path / 'foo')
+        with open(file_path, 'wb') as fd:
+            fd.write(b'foo')
+        file_stat = os.stat(file_path)
+        client.hash_file(file_path, use_cache=True)
+        with open(file_path, 'wb') as fd:
+            fd.write(b'bar')
+        os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+        assert client.hash_file(file_path, use_cache=True) == (
+            self.sha256(b'bar')
+        )
+
+    def test_replaced_with_restored_mtime(self, client, tmp_path):
+        file_path = str(tmp_path / 'foo')
+        replacement_path = str(tmp_path / 'bar')
+        for path, content in ((file_path, b'foo'), (replacement_path, b'bar')):
+            with open(path, 'wb') as fd:
+                fd.write(content)
+        file_stat = os.stat(file_path)
+        client.hash_file(file_path, use_cache=True)
+        os.utime(
+            replacement_path,
+            ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns),
+        )
+        os.replace(replacement_path, file_path)
+        assert client.hash_file(file_path, use_cache=True) == (
+            self.sha256(b'bar')
+        )
+
+    def test_authenticate_file_rehashes(self, client, tmp_path):
+        file_path = str(tmp_path / 'foo')
+        with open(file_path, 'wb') as fd:
+            fd.write(b'foo')
+        client.hash_file(file_path, use_cache=True)
+        with open(file_path, 'wb') as fd:
+            fd.write(b'bar')
+        with mock.patch.object(client, 'authenticate') as authenticate:
+            client.authenticate_file(file_path)
+        authenticate.assert_called_once_with(self.sha256(b'bar'))
+
+    def test_authenticate_file_precomputed_hash(self, client, tmp_path):
+        with mock.patch.object(
+            immudb_wrapper,
+            '_hash_file',
+        ) as hash_file, mock.patch.object(
+            client,
+            'authenticate',
+        ) as authenticate:
+            client.authenticate_file(
+                str(tmp_path / 'missing'),
+                precomputed_hash=self.sha256(b'foo'),
+            )
+        hash_file.assert_not_called()
+        authenticate.assert_called_once_with(self.sha256(b'foo'))
+
+
+class Color(Enum):
+    RED = 'red'
+
+
+class Size(IntEnum):
+    SMALL = 1
+
+
+class TestJson:
+    @pytest.mark.parametrize(
+        'value',
+        [
+            {'foo': 'bar', 'baz': [1, 2.5, None, True]},
+            {'foo': 2**70},
+            {'foo': 'Юникод'},
+            {'foo': [float('inf'), float('-inf'), None]},
+            {'foo': float('nan')},
+            {'1': 'foo', 2: 'bar', None: 'baz'},
+            {'foo': Size.SMALL, 'bar': (1, 2)},
+        ],
+    )
+    def test_value_round_trip(self, client, value):
+        response = SafeGetResponse(
+            id=1,
+            key=b'foo',
+            value=client.encode(value),
+            timestamp=1690794033,
+            verified=True,
+            refkey=None,
+            revision=1,
+        )
+        result = client.to_dict(response)
+        # NaN isn't equal to itself, so the values are compared as JSON
+        assert json.dumps(result.pop('value')) == json.dumps(value)
+        assert result == {
+            'id': 1,
+            'key': 'foo',
+            'timestamp': 1690794033,
+            'verified': True,
+            'refkey': None,
+            'revision': 1,
+        }
+
+    @pytest.mark.parametrize(
+        'value',
+        [
+            {'foo': datetime(2023, 7, 31)},
+            {'foo': SafeGetResponse(1, 'foo', 'bar', 1, True, None, 1)},
+            {date(2023, 7, 31): 'foo'},
+            {'foo': uuid.UUID('12345678-1234-5678-1234-567812345678')},
+            {'foo': Color.RED},
+        ],
+    )
+    def test_unsupported_value(self, client, value):
+        with pytest.raises(TypeError):
+            client.encode(value)
+
+    def test_stdlib_json_records(self, client):
+        response = SafeGetResponse(
+            id=1,
+            key=b'foo',
+            value=json.dumps({'foo': float('inf')}).encode(),
+            timestamp=1690794033,
+            verified=True,
+            refkey=None,
+            revision=1,
+        )
+        assert client.to_dict(response)['value'] == {'foo': float('inf')}